@@ -3,37 +3,106 @@ Agent module: initializes LangGraph/Groq model and runs agricultural assistant q
 Uses a ReAct-style reasoning agent with a web-search tool (Tavily).
 """
 
+import asyncio
+import hashlib
+import hmac
+import logging
+import secrets
+import threading
+import uuid
 from typing import TypedDict
+
+import aiohttp
+import aiosqlite
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from cachetools import TTLCache
 from langchain.tools import StructuredTool
-from langchain_community.tools.tavily_search import TavilySearchResults
 from langchain_groq import ChatGroq
 from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 from langgraph.prebuilt import create_react_agent
 from langchain.schema import SystemMessage, HumanMessage
-from app.config import TAVILY_API_KEY, GROQ_API_KEY
+from app.config import (
+    TAVILY_API_KEY,
+    GROQ_API_KEY,
+    TAVILY_CACHE_TTL,
+    CHECKPOINT_DB,
+    SESSION_ID_SECRET,
+)
+
+log = logging.getLogger("kisandost")
 
 
 # ---------- Tavily Search Tool ----------
+TAVILY_SEARCH_URL = "https://api.tavily.com/search"
+
+# Shared aiohttp session (created lazily on the running loop) and a cap on
+# concurrent Tavily calls so parallel tool invocations don't flood the API.
+_session: aiohttp.ClientSession | None = None
+_search_semaphore = asyncio.Semaphore(8)
+
+# Keep-alive session for the sync tool path
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=32))
+
+# Formatted search results keyed by normalized query, shared by sync and async tools
+_search_cache = TTLCache(maxsize=1024, ttl=TAVILY_CACHE_TTL)
+_search_cache_lock = threading.Lock()
+
+
+def _normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def _cache_get(query: str):
+    with _search_cache_lock:
+        return _search_cache.get(_normalize_query(query))
+
+
+def _cache_put(query: str, result: str):
+    with _search_cache_lock:
+        _search_cache[_normalize_query(query)] = result
+
+
+def clear_search_cache():
+    """Drop all cached Tavily search results."""
+    with _search_cache_lock:
+        _search_cache.clear()
+
+
+# Per-result content cap: the agent only needs hints, and shorter tool output
+# means less prompt to prefill on the next model call.
+MAX_RESULT_CONTENT_CHARS = 512
+
+
 def extract_search_results(raw_results):
     """Format Tavily search results into readable text."""
-    extracted = []
+    buf = []
+    buf_append = buf.append
     for item in raw_results:
-        url = item.get("url", "")
-        title = item.get("title", "")
-        content = item.get("content", "")
-        block = f"URL: {url}\nTitle: {title}\nContent: {content}\n---\n"
-        extracted.append(block)
-    return "\n".join(extracted)
-
-
-web_search = TavilySearchResults(
-    search_depth="basic",
-    max_results=3,
-    tavily_api_key=TAVILY_API_KEY,
-    include_raw_content=False,
-    include_images=False,
-    include_answer=False,
-)
+        buf_append("URL: ")
+        buf_append(item.get("url", ""))
+        buf_append("\nTitle: ")
+        buf_append(item.get("title", ""))
+        buf_append("\nContent: ")
+        buf_append(item.get("content", "")[:MAX_RESULT_CONTENT_CHARS])
+        buf_append("\n---\n")
+    return "".join(buf)
+
+
+def _tavily_payload(query: str) -> dict:
+    return {
+        "api_key": TAVILY_API_KEY,
+        "query": query,
+        "search_depth": "basic",
+        "max_results": 3,
+        "include_raw_content": False,
+        "include_images": False,
+        "include_answer": False,
+    }
+
 
 class WebSearchInput(TypedDict):
     query: str
@@ -41,95 +110,331 @@ class WebSearchInput(TypedDict):
 def web_search_tool_fn(query: str) -> str:
     """Search agricultural info (chemicals, fertilizers, etc.)"""
     try:
-        print(f"[Search] Query: {query}")
-        res = web_search.invoke({"query": query})
-        if isinstance(res, str):
-            return res
-        raw = res.get("results", []) if isinstance(res, dict) else []
+        log.debug("[Search] Query: %s", query)
+        cached = _cache_get(query)
+        if cached is not None:
+            return cached
+        resp = _SESSION.post(TAVILY_SEARCH_URL, json=_tavily_payload(query), timeout=8)
+        resp.raise_for_status()
+        data = resp.json()
+        raw = data.get("results", []) if isinstance(data, dict) else []
         if not raw:
             return "No relevant results found."
-        return extract_search_results(raw)
+        result = extract_search_results(raw)
+        _cache_put(query, result)
+        return result
     except Exception as e:
         return f"[Search Error]: {e}"
 
+
+async def start_search_session():
+    """Create the shared aiohttp session (call from the app startup hook)."""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=8),
+            connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300),
+        )
+    return _session
+
+
+async def close_search_session():
+    """Close the shared aiohttp session (call from the app shutdown hook)."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def _tavily_search(query: str) -> str:
+    """Search agricultural info (chemicals, fertilizers, etc.)"""
+    try:
+        log.debug("[Search] Query: %s", query)
+        cached = _cache_get(query)
+        if cached is not None:
+            return cached
+        session = await start_search_session()
+        async with _search_semaphore:
+            async with session.post(TAVILY_SEARCH_URL, json=_tavily_payload(query)) as resp:
+                resp.raise_for_status()
+                data = await resp.json()
+        raw = data.get("results", []) if isinstance(data, dict) else []
+        if not raw:
+            return "No relevant results found."
+        result = extract_search_results(raw)
+        _cache_put(query, result)
+        return result
+    except Exception as e:
+        return f"[Search Error]: {e}"
+
+
 web_search_tool = StructuredTool.from_function(
     func=web_search_tool_fn,
+    coroutine=_tavily_search,
     name="web_search_tool",
     description="Search agricultural information using Tavily.",
 )
 
 
 # ---------- Agent Initialization ----------
-def initialize_agent():
-    """Create and return a LangGraph ReAct agent."""
-    try:
-        print("[Agent] Initializing agent...")
-        memory = MemorySaver()
-        model = ChatGroq(
+# Process-wide agent and the HTTP client shared by ChatGroq, so the connection
+# pool and TLS sessions stay hot across requests.
+_AGENT = None
+_ANONYMOUS_AGENT = None
+_MODEL = None
+_CHECKPOINTER = None
+_AGENT_LOCK = threading.Lock()
+_groq_http_client: httpx.AsyncClient | None = None
+
+_SESSION_ID_KEY = (SESSION_ID_SECRET or secrets.token_hex(32)).encode("utf-8")
+
+
+def thread_id_for(farmer_id: str | None) -> str:
+    """
+    Checkpointer thread id for a farmer: a keyed HMAC of their session id (e.g.
+    phone number), so ids are stable but not reversible by enumerating numbers.
+    Anonymous requests get a fresh one-off thread and never share history.
+    """
+    if not farmer_id:
+        return f"anon-{uuid.uuid4().hex}"
+    return hmac.new(_SESSION_ID_KEY, farmer_id.encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+
+
+def open_checkpointer():
+    """
+    Return the conversation checkpointer: SQLite-backed when CHECKPOINT_DB is set
+    (so state survives restarts and is shared by workers), else MemorySaver.
+    Must be called from the running event loop (e.g. the app startup hook).
+    """
+    global _CHECKPOINTER
+    if CHECKPOINT_DB:
+        # A per-process random key would give each worker (and each restart)
+        # different thread ids for the same farmer, orphaning stored threads
+        if not SESSION_ID_SECRET:
+            raise RuntimeError("CHECKPOINT_DB is set but SESSION_ID_SECRET is not; set it to a stable secret")
+        _CHECKPOINTER = AsyncSqliteSaver(aiosqlite.connect(CHECKPOINT_DB))
+    else:
+        _CHECKPOINTER = MemorySaver()
+    return _CHECKPOINTER
+
+
+async def close_checkpointer():
+    """Close the SQLite connection opened by open_checkpointer(), if any."""
+    global _CHECKPOINTER
+    conn = getattr(_CHECKPOINTER, "conn", None)
+    if conn is not None:
+        await conn.close()
+    _CHECKPOINTER = None
+
+
+def _get_model():
+    """Return the ChatGroq model shared by every agent, creating it (and its HTTP client) once."""
+    global _MODEL, _groq_http_client
+    if _MODEL is None:
+        if _groq_http_client is None or _groq_http_client.is_closed:
+            _groq_http_client = httpx.AsyncClient()
+        _MODEL = ChatGroq(
             model="openai/gpt-oss-120b",  
             temperature=0.3,
             max_tokens=1500,
             api_key=GROQ_API_KEY,
+            http_async_client=_groq_http_client,
         )
+    return _MODEL
+
+
+def initialize_agent(checkpointer=None, persistent=True):
+    """
+    Create and return a LangGraph ReAct agent (in-memory checkpoints by default).
+    With persistent=False the agent keeps no checkpoints at all.
+    """
+    try:
+        log.info("[Agent] Initializing agent...")
+        if not persistent:
+            memory = None
+        else:
+            memory = checkpointer if checkpointer is not None else MemorySaver()
+        model = _get_model()
         tools = [web_search_tool]
-        agent_executor = create_react_agent(model, tools, checkpointer=memory)
-        print("[Agent] Initialized.")
+        # The system prompt is prepended on each model call instead of being
+        # stored in the thread, so persisted histories hold it zero times
+        agent_executor = create_react_agent(
+            model, tools, state_modifier=_SYSTEM_MESSAGE, checkpointer=memory
+        )
+        log.info("[Agent] Initialized.")
         return agent_executor
     except Exception as e:
-        print(f"[Agent] Initialization error: {e}")
+        log.error("[Agent] Initialization error: %s", e)
         return None
 
 
+def get_agent(checkpointer=None):
+    """
+    Return the shared agent, initializing it once on first use.
+    Passing a checkpointer once the agent exists is an error (it would be unused).
+    """
+    global _AGENT
+    if _AGENT is None or checkpointer is not None:
+        with _AGENT_LOCK:
+            if _AGENT is None:
+                _AGENT = initialize_agent(checkpointer)
+            elif checkpointer is not None:
+                raise RuntimeError("Agent already initialized; call close_agent() before passing a checkpointer")
+    return _AGENT
+
+
+def get_anonymous_agent():
+    """
+    Return the shared checkpoint-free agent for requests without a session id,
+    so one-off conversations are never written to the checkpointer.
+    """
+    global _ANONYMOUS_AGENT
+    if _ANONYMOUS_AGENT is None:
+        with _AGENT_LOCK:
+            if _ANONYMOUS_AGENT is None:
+                _ANONYMOUS_AGENT = initialize_agent(persistent=False)
+    return _ANONYMOUS_AGENT
+
+
+async def prewarm_agent():
+    """Fire a 1-token request so the Groq connection and system-prompt prefix are warm."""
+    if _MODEL is None:
+        return
+    try:
+        await _MODEL.ainvoke([_SYSTEM_MESSAGE, HumanMessage(content="ping")], max_tokens=1)
+    except Exception as e:
+        log.warning("[Agent] Prewarm error: %s", e)
+
+
+async def close_agent():
+    """Drop the shared agents and close their ChatGroq HTTP client (call from the app shutdown hook)."""
+    global _AGENT, _ANONYMOUS_AGENT, _MODEL, _groq_http_client
+    with _AGENT_LOCK:
+        _AGENT = None
+        _ANONYMOUS_AGENT = None
+        _MODEL = None
+        client, _groq_http_client = _groq_http_client, None
+    if client is not None:
+        await client.aclose()
+
+
 # ---------- Message Builder ----------
+# Built once so the system prompt is byte-identical on every request
+# (lets Groq reuse its cached prefix instead of re-prefilling it).
+_SYSTEM_MESSAGE = SystemMessage(
+    content=(
+        "You are a helpful agricultural assistant for farmers in Pakistan. "
+        "You explain the usage, safety, and crop compatibility of agricultural "
+        "chemicals like pesticides, herbicides, and fertilizers.\n\n"
+        "If you are unsure, use the web_search_tool once to check reliable sources. "
+        "Keep your answer short, clear, and practical."
+    )
+)
+
+
 def chat_completion(user_input: str):
-    """Convert user input into a structured prompt for the agent."""
-    return [
-        SystemMessage(
-            content=(
-                "You are a helpful agricultural assistant for farmers in Pakistan. "
-                "You explain the usage, safety, and crop compatibility of agricultural "
-                "chemicals like pesticides, herbicides, and fertilizers.\n\n"
-                "If you are unsure, use the web_search_tool once to check reliable sources. "
-                "Keep your answer short, clear, and practical."
-            )
-        ),
-        HumanMessage(content=user_input),
-    ]
+    """
+    Convert user input into the messages for one agent turn. The system prompt
+    is added by the agent itself (state_modifier), not stored per turn.
+    """
+    return [HumanMessage(content=user_input)]
 
 
 # ---------- Main Query Runner ----------
-def run_query(input_message, agent_executor=None):
+def _final_ai_content(step, response_text: str) -> str:
+    """Return the agent node's latest AI text from an "updates" step, else response_text."""
+    for node_name, node_update in step.items():
+        if node_name != "agent" or not node_update or "messages" not in node_update:
+            continue
+
+        latest = node_update["messages"][-1]
+        content = getattr(latest, "content", None)
+
+        if getattr(latest, "type", None) == "ai" and content:
+            response_text = content
+    return response_text
+
+
+def run_query(input_message, agent_executor=None, thread_id: str | None = None):
     """Run the ReAct agent and return its textual response."""
     if agent_executor is None:
-        agent_executor = initialize_agent()
+        # Without a thread there is no history to keep
+        agent_executor = get_agent() if thread_id else get_anonymous_agent()
         if agent_executor is None:
             return "Agent initialization failed."
 
     try:
-        print("[Agent] Running query...")
-        config = {"configurable": {"thread_id": "farmguide-session"}}
+        log.debug("[Agent] Running query...")
+        config = {"configurable": {"thread_id": thread_id or thread_id_for(None)}}
         response_text = ""
 
+        # "updates" yields only each node's delta, not the whole growing history
         for step in agent_executor.stream(
-            {"messages": input_message}, config, stream_mode="values"
+            {"messages": input_message}, config, stream_mode="updates"
         ):
-            messages = step.get("messages") if isinstance(step, dict) else getattr(step, "messages", None)
-            if not messages:
-                continue
+            response_text = _final_ai_content(step, response_text)
+
+        response_text = response_text or "No answer produced by agent."
+        log.debug("[Agent] Response: %s", response_text[:300])
+        return response_text
+
+    except Exception as e:
+        log.error("[Agent] Execution error: %s", e)
+        return f"Agent execution error: {e}"
+
+
+async def arun_query(input_message, agent_executor=None, thread_id: str | None = None):
+    """Async run_query: return only the agent's final AI message (no pre-tool-call text)."""
+    if agent_executor is None:
+        # Without a thread there is no history to keep
+        agent_executor = get_agent() if thread_id else get_anonymous_agent()
+        if agent_executor is None:
+            return "Agent initialization failed."
 
-            latest = messages[-1]
-            role = getattr(latest, "role", None)
-            content = getattr(latest, "content", None)
+    try:
+        log.debug("[Agent] Running query...")
+        config = {"configurable": {"thread_id": thread_id or thread_id_for(None)}}
+        response_text = ""
 
-            if role in ("assistant", "ai") and content:
-                response_text = content
+        async for step in agent_executor.astream(
+            {"messages": input_message}, config, stream_mode="updates"
+        ):
+            response_text = _final_ai_content(step, response_text)
 
         response_text = response_text or "No answer produced by agent."
-        print(f"[Agent] Response: {response_text[:300]}")
+        log.debug("[Agent] Response: %s", response_text[:300])
         return response_text
 
     except Exception as e:
-        print(f"[Agent] Execution error: {e}")
+        log.error("[Agent] Execution error: %s", e)
         return f"Agent execution error: {e}"
 
 
+async def run_query_stream(input_message, agent_executor=None, thread_id: str | None = None):
+    """Run the ReAct agent and yield assistant text tokens as they are generated."""
+    if agent_executor is None:
+        # Without a thread there is no history to keep
+        agent_executor = get_agent() if thread_id else get_anonymous_agent()
+        if agent_executor is None:
+            yield "Agent initialization failed."
+            return
+
+    try:
+        log.debug("[Agent] Streaming query...")
+        config = {"configurable": {"thread_id": thread_id or thread_id_for(None)}}
+
+        async for chunk, metadata in agent_executor.astream(
+            {"messages": input_message}, config, stream_mode="messages"
+        ):
+            # Only forward tokens produced by the model node, not tool output
+            if metadata.get("langgraph_node") != "agent":
+                continue
+            content = getattr(chunk, "content", None)
+            if content and isinstance(content, str):
+                yield content
+
+    except Exception as e:
+        log.error("[Agent] Execution error: %s", e)
+        yield f"Agent execution error: {e}"
+
+
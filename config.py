@@ -6,6 +6,7 @@ Uses environment variables where appropriate.
 
 from dotenv import load_dotenv
 from pathlib import Path
+import logging
 import os
 
 load_dotenv()
@@ -14,14 +15,32 @@ load_dotenv()
 TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
+# SQLite file for agent conversation checkpoints (shared across workers), e.g.
+# "checkpoints.db"; empty keeps per-process in-memory checkpoints.
+# Requires SESSION_ID_SECRET, otherwise the app refuses to start.
+CHECKPOINT_DB = os.getenv("CHECKPOINT_DB", "")
+
+# Server secret for deriving per-farmer thread ids from session ids (HMAC);
+# must be the same for every worker. If unset (in-memory checkpoints only),
+# a random per-process key is used and ids change on restart
+SESSION_ID_SECRET = os.getenv("SESSION_ID_SECRET", "")
+
+# Seconds a cached Tavily search result stays valid
+TAVILY_CACHE_TTL = int(os.getenv("TAVILY_CACHE_TTL", "3600"))
+
 # Default language and models
 DEFAULT_LANGUAGE = os.getenv("DEFAULT_LANGUAGE", "en")
 WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base")
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")  # faster-whisper/CTranslate2
 TTS_PREFIX = os.getenv("TTS_PREFIX", "response")
 
 # OCR language: "en", "ur", "multilang", etc.
 OCR_LANG = os.getenv("OCR_LANG", "en")
 
+# Optional directory with int8-quantized ONNX OCR models (det.onnx, rec.onnx,
+# cls.onnx); when set, PaddleOCR runs them through onnxruntime instead of Paddle
+OCR_ONNX_DIR = os.getenv("OCR_ONNX_DIR", "")
+
 # Output directories (Path objects)
 BASE_OUTPUT = Path("outputs")
 OUTPUT_DIRS = {
@@ -31,12 +50,32 @@ OUTPUT_DIRS = {
     "ocr_outputs": BASE_OUTPUT / "ocr"
 }
 
-# Create directories if they do not exist
-for p in OUTPUT_DIRS.values():
-    p.mkdir(parents=True, exist_ok=True)
+# Scratch directory for uploaded files
+TEMP_DIR = Path("temp")
+
+
+def ensure_dirs():
+    """Create output and temp directories; call once at app startup, not per import."""
+    for p in (*OUTPUT_DIRS.values(), TEMP_DIR):
+        p.mkdir(parents=True, exist_ok=True)
 
 # ==========================
 # 🧩 APP SETTINGS
 # ==========================
-DEBUG = True                    # Enable for verbose logs (set False in production)
+# Enable for verbose logs (set DEBUG=false in production)
+DEBUG = os.getenv("DEBUG", "true").lower() in ("1", "true", "yes")
+
+# App logger; silent until configure_logging() attaches a real handler
+logging.getLogger("kisandost").addHandler(logging.NullHandler())
+
+
+def configure_logging():
+    """Send app logs to stderr: everything when DEBUG, otherwise warnings and errors only."""
+    log = logging.getLogger("kisandost")
+    log.setLevel(logging.DEBUG if DEBUG else logging.WARNING)
+    if any(isinstance(h, logging.StreamHandler) for h in log.handlers):
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    log.addHandler(handler)
 
@@ -3,18 +3,44 @@
 FastAPI entrypoint for KisanDost backend.
 Unified endpoint:
   POST /api/farmer-query
-Accepts optional voice_file and/or image_file, and returns a TTS audio path.
+Accepts optional voice_file and/or image_file, and returns a TTS audio path
+(or, with stream=true, a text/event-stream of agent tokens and per-sentence audio).
 """
 
-import os
-import shutil
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+import asyncio
+import io
+import logging
+import re
+import uuid
+from collections import deque
+from itertools import count
+from pathlib import Path
+
+import aiofiles
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+
+from app.ocr import run_ocr, warmup_ocr
+from app.voice import transcribe_audio, text_to_speech, warmup_whisper
+from app.agent import (
+    arun_query,
+    run_query_stream,
+    chat_completion,
+    get_agent,
+    get_anonymous_agent,
+    thread_id_for,
+    open_checkpointer,
+    close_checkpointer,
+    prewarm_agent,
+    close_agent,
+    start_search_session,
+    close_search_session,
+)
+from app.config import DEFAULT_LANGUAGE, OUTPUT_DIRS, TEMP_DIR, TTS_PREFIX, ensure_dirs, configure_logging
 
-from app.ocr import run_ocr
-from app.voice import transcribe_audio, text_to_speech
-from app.agent import run_query, chat_completion
-from app.config import DEFAULT_LANGUAGE, OUTPUT_DIRS
+configure_logging()
+log = logging.getLogger("kisandost")
 
 app = FastAPI(title="KisanDost Backend", version="1.0")
 
@@ -28,79 +54,232 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+async def startup():
+    ensure_dirs()
+    await start_search_session()
+    app.state.agent = get_agent(open_checkpointer())
+    app.state.anonymous_agent = get_anonymous_agent()
+    # Load OCR/ASR weights and open the Groq connection in parallel, so the
+    # first request doesn't pay for it
+    await asyncio.gather(
+        asyncio.to_thread(warmup_ocr),
+        asyncio.to_thread(warmup_whisper),
+        prewarm_agent(),
+    )
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await close_search_session()
+    await close_agent()
+    await close_checkpointer()
+
+
+def get_agent_executor(request: Request, session_id: str | None = Form(None)):
+    """
+    Dependency returning an agent built once at startup: the checkpointed one
+    for farmers with a session_id, else the stateless one (nothing persisted).
+    """
+    if session_id:
+        return request.app.state.agent
+    return request.app.state.anonymous_agent
+
+
 @app.get("/ping")
 def ping():
     return {"message": "Backend running"}
 
 
+def _temp_path(upload: UploadFile) -> Path:
+    """Unique temp/ path for an upload (client filenames like crop.jpg repeat across requests)."""
+    return TEMP_DIR / f"{uuid.uuid4().hex}{Path(upload.filename or '').suffix}"
+
+
+async def _save_upload(upload: UploadFile, path: Path):
+    """Stream an upload to disk in 1 MiB chunks without blocking the event loop."""
+    async with aiofiles.open(path, "wb") as f:
+        while chunk := await upload.read(1 << 20):
+            await f.write(chunk)
+
+
+# Uploads up to this size are transcribed straight from memory; larger (or
+# unknown-size) ones are streamed to temp/ first
+_INMEMORY_AUDIO_MAX_BYTES = 8 << 20
+
+
+async def _transcribe_upload(voice_file: UploadFile, lang: str) -> str | None:
+    """Transcribe the uploaded audio in a worker thread (from memory when it is small)."""
+    if voice_file.size is not None and voice_file.size <= _INMEMORY_AUDIO_MAX_BYTES:
+        audio = io.BytesIO(await voice_file.read())
+        audio.name = voice_file.filename
+        return await asyncio.to_thread(transcribe_audio, audio, language=lang)
+
+    audio_path = _temp_path(voice_file)
+    try:
+        await _save_upload(voice_file, audio_path)
+        return await asyncio.to_thread(transcribe_audio, str(audio_path), language=lang)
+    finally:
+        audio_path.unlink(missing_ok=True)
+
+
+async def _ocr_upload(image_file: UploadFile) -> str:
+    """Save the uploaded image under temp/ and OCR it in a worker thread."""
+    image_path = _temp_path(image_file)
+    try:
+        await _save_upload(image_file, image_path)
+        return await asyncio.to_thread(run_ocr, str(image_path))
+    finally:
+        image_path.unlink(missing_ok=True)
+
+
+def _sse(data: str, event: str | None = None) -> str:
+    """Format one Server-Sent Events frame (multi-line data split per SSE spec)."""
+    lines = [f"event: {event}"] if event else []
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+
+# Sentence end: terminal punctuation (incl. Urdu/Sindhi) followed by whitespace,
+# or a newline on its own (list items often have no terminal punctuation)
+_SENTENCE_END = re.compile(r"(?:[.!?\u06d4\u061f]+\s+|\n+)")
+_SENTENCE_END_CHARS = frozenset(".!?\u06d4\u061f\n")
+
+# Cap on concurrent gTTS calls process-wide (below the TTS session pool size),
+# so long answers don't flood Google TTS or starve ASR/OCR worker threads
+_TTS_LIMIT = asyncio.Semaphore(4)
+
+
+async def _synthesize(text: str, lang: str, filename_prefix: str = TTS_PREFIX) -> str | None:
+    async with _TTS_LIMIT:
+        return await asyncio.to_thread(text_to_speech, text, language=lang, filename_prefix=filename_prefix)
+
+
+def _voice_event(sentence: str, tts_path: str | None) -> str:
+    """SSE frame for one synthesized sentence; failures are reported, not dropped."""
+    if tts_path:
+        return _sse(tts_path, event="voice_chunk")
+    return _sse(sentence, event="voice_error")
+
+
+async def _stream_agent_response(input_message, agent_executor, thread_id: str, lang: str):
+    """
+    Relay agent tokens as SSE frames. Each completed sentence is sent to TTS
+    while the agent keeps generating; the mp3 paths are emitted in order as
+    "voice_chunk" events as soon as they are ready (or a "voice_error" event
+    carrying the sentence text if its TTS failed), then a final "done" event.
+    """
+    prefix = f"{TTS_PREFIX}_{uuid.uuid4().hex[:8]}"
+    sentence_ids = count()
+    pending = deque()
+
+    def speak(sentence: str):
+        filename_prefix = f"{prefix}_{next(sentence_ids):03d}"
+        pending.append((sentence, asyncio.create_task(_synthesize(sentence, lang, filename_prefix))))
+
+    # Tokens of the unfinished sentence; joined only when a token may close it,
+    # so accumulation stays linear instead of re-copying a growing string
+    sentence_buf = []
+    after_end_char = False
+    try:
+        async for token in run_query_stream(input_message, agent_executor, thread_id):
+            yield _sse(token)
+
+            sentence_buf.append(token)
+            maybe_boundary = (
+                not _SENTENCE_END_CHARS.isdisjoint(token)
+                or (after_end_char and token[:1].isspace())
+            )
+            after_end_char = token[-1:] in _SENTENCE_END_CHARS
+            if maybe_boundary:
+                pending_text = "".join(sentence_buf)
+                boundary = None
+                for boundary in _SENTENCE_END.finditer(pending_text):
+                    pass
+                if boundary:
+                    speak(pending_text[:boundary.end()].strip())
+                    sentence_buf = [pending_text[boundary.end():]]
+
+            while pending and pending[0][1].done():
+                sentence, task = pending.popleft()
+                yield _voice_event(sentence, task.result())
+
+        remainder = "".join(sentence_buf).strip()
+        if remainder:
+            speak(remainder)
+
+        while pending:
+            sentence, task = pending.popleft()
+            yield _voice_event(sentence, await task)
+
+        yield _sse("", event="done")
+    finally:
+        # Client disconnected (or the agent failed): don't leave TTS tasks behind
+        for _, task in pending:
+            task.cancel()
+
+
 @app.post("/api/farmer-query")
 async def farmer_query(
     voice_file: UploadFile | None = File(None),
     image_file: UploadFile | None = File(None),
     lang: str = Form(DEFAULT_LANGUAGE),
+    stream: bool = Form(False),
+    session_id: str | None = Form(None),
+    agent_executor=Depends(get_agent_executor),
 ):
     """
     Unified endpoint:
     - voice_file: optional audio file (wav, mp3, ogg, webm)
     - image_file: optional image (jpg, png)
     - lang: language code (en, ur, sd)
+    - stream: if true, respond with SSE "data:" frames carrying agent tokens,
+      interleaved with "voice_chunk" events (one mp3 path per sentence, or a
+      "voice_error" event with the sentence text if its TTS failed) and
+      ending with a "done" event
+    - session_id: optional farmer identifier (e.g. phone number); keeps a
+      separate, persistent conversation per farmer. Without it the request
+      runs in a one-off conversation that is never checkpointed.
     Returns: {"voice_response": "<relative path to mp3>"} or HTTP error.
     """
 
-    os.makedirs("temp", exist_ok=True)
-    combined_text_parts = []
-
-    # Save and transcribe voice
+    # Transcribe voice and OCR image concurrently
+    stages = {}
     if voice_file:
-        try:
-            voice_path = os.path.join("temp", voice_file.filename)
-            with open(voice_path, "wb") as f:
-                shutil.copyfileobj(voice_file.file, f)
-            transcript = transcribe_audio(voice_path, language=lang)
-            if transcript:
-                combined_text_parts.append(transcript)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"ASR error: {e}")
-
-    # Save and OCR image
+        stages["ASR"] = _transcribe_upload(voice_file, lang)
     if image_file:
-        try:
-            image_path = os.path.join("temp", image_file.filename)
-            with open(image_path, "wb") as f:
-                shutil.copyfileobj(image_file.file, f)
-            ocr_text = run_ocr(image_path)
-            if ocr_text:
-                combined_text_parts.append(ocr_text)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"OCR error: {e}")
+        stages["OCR"] = _ocr_upload(image_file)
+    results = await asyncio.gather(*stages.values(), return_exceptions=True)
+
+    combined_text_parts = []
+    for stage, result in zip(stages, results):
+        if isinstance(result, Exception):
+            raise HTTPException(status_code=500, detail=f"{stage} error: {result}")
+        if result:
+            combined_text_parts.append(result)
 
     if not combined_text_parts:
         raise HTTPException(status_code=400, detail="No valid input provided (voice or image).")
 
     combined_query = "\n\n".join(combined_text_parts)
-    print(f"[Main] Combined query length: {len(combined_query)} chars")
-
-    # Build messages for agent
-    messages = [
-        {
-            "role": "system",
-            "content": (
-                "You are an agricultural assistant for farmers in Pakistan. "
-                "Explain usage, safety, and compatibility of agricultural chemicals. "
-                "Keep answers short and practical. If needed, use the web search tool once."
-            ),
-        },
-        {"role": "user", "content": combined_query},
-    ]
-
-    # Run agent
-    agent_text = run_query(chat_completion(combined_query))
+    log.debug("[Main] Combined query length: %d chars", len(combined_query))
+
+    thread_id = thread_id_for(session_id)
+
+    if stream:
+        return StreamingResponse(
+            _stream_agent_response(chat_completion(combined_query), agent_executor, thread_id, lang),
+            media_type="text/event-stream",
+        )
+
+    # Run agent; only its final answer is spoken
+    agent_text = await arun_query(chat_completion(combined_query), agent_executor, thread_id)
 
     if not agent_text:
         raise HTTPException(status_code=500, detail="Agent produced no response.")
 
     # Convert to speech
-    tts_path = text_to_speech(agent_text, language=lang)
+    tts_path = await _synthesize(agent_text, lang)
     if not tts_path:
         raise HTTPException(status_code=500, detail="TTS generation failed.")
 
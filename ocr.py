@@ -2,28 +2,110 @@
 """
 PaddleOCR helper.
 Provides run_ocr(image_path) -> str
+
+Set OCR_ONNX_DIR to run int8 ONNX models via onnxruntime instead of the FP32
+Paddle backend. Export the det/rec/cls inference models with paddle2onnx, e.g.
+  paddle2onnx --model_dir <det_dir> --model_filename inference.pdmodel \
+      --params_filename inference.pdiparams --save_file onnx/det.onnx
+then quantize them with quantize_ocr_models("onnx", OCR_ONNX_DIR).
 """
 
+import logging
+import os
+import threading
+import numpy as np
 from paddleocr import PaddleOCR
 from pathlib import Path
-from app.config import OCR_LANG, OUTPUT_DIRS
+from PIL import Image
+from app.config import OCR_LANG, OCR_ONNX_DIR, OUTPUT_DIRS
+
+log = logging.getLogger("kisandost")
+
+_ONNX_MODELS = ("det.onnx", "rec.onnx", "cls.onnx")
+
+
+def _onnx_model_paths(model_dir: str) -> list[str]:
+    """Paths of the det/rec/cls ONNX models in model_dir; all three are required."""
+    paths = [os.path.join(model_dir, name) for name in _ONNX_MODELS]
+    missing = [p for p in paths if not os.path.exists(p)]
+    if missing:
+        raise FileNotFoundError(f"Missing ONNX OCR models: {', '.join(missing)}")
+    return paths
+
+
+def _build_ocr() -> PaddleOCR:
+    """Create a PaddleOCR engine, on onnxruntime if OCR_ONNX_DIR is configured."""
+    if not OCR_ONNX_DIR:
+        return PaddleOCR(lang=OCR_LANG, use_angle_cls=True, show_log=False)
+    det, rec, cls = _onnx_model_paths(OCR_ONNX_DIR)
+    return PaddleOCR(
+        lang=OCR_LANG,
+        use_angle_cls=True,
+        show_log=False,
+        use_onnx=True,
+        det_model_dir=det,
+        rec_model_dir=rec,
+        cls_model_dir=cls,
+    )
+
+
+def quantize_ocr_models(src_dir: str, dst_dir: str):
+    """
+    Dynamically quantize exported ONNX OCR models (det/rec/cls) to int8 weights.
+    Offline step; writes models with the same file names into dst_dir.
+    All three models must exist, as _build_ocr() loads all of them.
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
 
-# Ensure OCR output dir exists (already created in config, keep safe)
-Path(OUTPUT_DIRS["ocr_outputs"]).mkdir(parents=True, exist_ok=True)
+    sources = _onnx_model_paths(src_dir)
+    Path(dst_dir).mkdir(parents=True, exist_ok=True)
+    for src, name in zip(sources, _ONNX_MODELS):
+        log.info("[OCR] Quantizing %s -> %s", src, Path(dst_dir) / name)
+        quantize_dynamic(src, str(Path(dst_dir) / name), weight_type=QuantType.QInt8)
 
-# Initialize PaddleOCR model once
-print(f"[OCR] Initializing PaddleOCR (lang={OCR_LANG})")
-ocr = PaddleOCR(lang=OCR_LANG, use_angle_cls=True, show_log=False)
+
+# Initialize PaddleOCR model once. The (small) angle classifier is loaded but
+# only run per call when the image is rotated; upright labels skip it (cls=False).
+log.info("[OCR] Initializing PaddleOCR (lang=%s, onnx=%s)", OCR_LANG, bool(OCR_ONNX_DIR))
+ocr = _build_ocr()
+
+# Paddle predictors are not thread-safe; run_ocr is called from to_thread workers
+_OCR_LOCK = threading.Lock()
+
+# EXIF orientation values for images stored rotated/transposed
+_ROTATED_ORIENTATIONS = {3, 5, 6, 7, 8}
+
+
+def warmup_ocr():
+    """Run a dummy inference so weights and allocator arenas are hot before the first request."""
+    try:
+        log.info("[OCR] Warming up")
+        with _OCR_LOCK:
+            ocr.ocr(np.full((32, 32, 3), 255, dtype=np.uint8), cls=False)
+    except Exception as e:
+        log.warning("[OCR] Warmup error: %s", e)
+
+
+def _is_exif_rotated(image_path: str) -> bool:
+    try:
+        with Image.open(image_path) as img:
+            return img.getexif().get(0x0112, 1) in _ROTATED_ORIENTATIONS
+    except Exception:
+        return False
 
 
-def run_ocr(image_path: str, save_output: bool = True) -> str:
+def run_ocr(image_path: str, save_output: bool = True, force_rotation: bool = False) -> str:
     """
     Run OCR on image_path and return extracted text (as a single string).
     Saves output to outputs/ocr if save_output=True.
+    The angle classifier only runs if force_rotation=True or the image's EXIF
+    orientation says it is rotated.
     """
     try:
-        print(f"[OCR] Running OCR on: {image_path}")
-        result = ocr.ocr(str(image_path), cls=True)
+        log.debug("[OCR] Running OCR on: %s", image_path)
+        rotate = force_rotation or _is_exif_rotated(image_path)
+        with _OCR_LOCK:
+            result = ocr.ocr(str(image_path), cls=rotate)
 
         extracted = []
         # result is a list of lines; handle possible structures
@@ -44,19 +126,20 @@ def run_ocr(image_path: str, save_output: bool = True) -> str:
 
         final_text = "\n".join(extracted).strip()
         if not final_text:
-            print("[OCR] No text detected")
+            log.debug("[OCR] No text detected")
             return ""
 
         if save_output:
             out_file = OUTPUT_DIRS["ocr_outputs"] / f"ocr_result_{Path(image_path).stem}.txt"
+            out_file.parent.mkdir(parents=True, exist_ok=True)
             with open(out_file, "w", encoding="utf-8") as fh:
                 fh.write(final_text)
-            print(f"[OCR] Saved OCR text to: {out_file}")
+            log.debug("[OCR] Saved OCR text to: %s", out_file)
 
-        print(f"[OCR] Extracted text (first 200 chars): {final_text[:200]}")
+        log.debug("[OCR] Extracted text (first 200 chars): %s", final_text[:200])
         return final_text
 
     except Exception as e:
-        print(f"[OCR] Error: {e}")
+        log.warning("[OCR] Error: %s", e)
         return ""
 
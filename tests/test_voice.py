@@ -0,0 +1,47 @@
+# app/tests/test_voice.py
+"""
+Checks _SessionGTTS against a recorded gTTS 2.5.4 batchexecute response.
+Run from the directory containing the app package:
+  python -m unittest app.tests.test_voice
+"""
+
+import base64
+import unittest
+from unittest import mock
+
+from gtts import gTTSError
+
+from app.voice import _SessionGTTS, _TTS_SESSION
+
+AUDIO = b"\xff\xf3\x44\xc4mp3-frame"
+RECORDED_LINE = (
+    '[["wrb.fr","jQ1olc","[\\"%s\\"]",null,null,null,"generic"]]'
+    % base64.b64encode(AUDIO).decode("ascii")
+)
+
+
+def _response(*lines: str):
+    r = mock.Mock()
+    r.iter_lines.return_value = [line.encode("utf-8") for line in lines]
+    return r
+
+
+class SessionGTTSTest(unittest.TestCase):
+    def test_decodes_audio_through_shared_session_with_tls_verification(self):
+        tts = _SessionGTTS(text="hello", lang="en")
+        with mock.patch.object(_TTS_SESSION, "send", return_value=_response(")]}'", RECORDED_LINE)) as send:
+            audio = b"".join(tts.stream())
+
+        self.assertEqual(audio, AUDIO)
+        send.assert_called_once()
+        self.assertIs(send.call_args.kwargs["verify"], True)
+
+    def test_response_without_audio_raises(self):
+        tts = _SessionGTTS(text="hello", lang="en")
+        with mock.patch.object(_TTS_SESSION, "send", return_value=_response('[["wrb.fr","jQ1olc",null]]')):
+            with self.assertRaises(gTTSError):
+                list(tts.stream())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,21 +1,36 @@
 # app/voice.py
 """
 Speech utilities: ASR (Whisper), translation, and TTS (gTTS).
-- Uses openai-whisper (lazy model load)
+- Uses faster-whisper / CTranslate2 with int8 weights (lazy model load)
 - Uses deep_translator for optional translation
 - Uses gTTS for TTS; Sindhi falls back to Urdu if unsupported
 """
 
+import base64
+import logging
 import os
-import time
+import re
+import threading
+import urllib.request
+import uuid
+import numpy as np
+import requests
+from cachetools import LRUCache
 from pathlib import Path
-from gtts import gTTS
+from typing import BinaryIO
+from requests.adapters import HTTPAdapter
+from gtts import gTTS, gTTSError
 from deep_translator import GoogleTranslator
-import whisper  # ensure package openai-whisper is installed
-from app.config import DEFAULT_LANGUAGE, WHISPER_MODEL, TTS_PREFIX, OUTPUT_DIRS
+from faster_whisper import WhisperModel
+from app.config import (
+    DEFAULT_LANGUAGE,
+    WHISPER_MODEL,
+    WHISPER_COMPUTE_TYPE,
+    TTS_PREFIX,
+    OUTPUT_DIRS,
+)
 
-# Ensure output directories exist
-Path(OUTPUT_DIRS["voice_outputs"]).mkdir(parents=True, exist_ok=True)
+log = logging.getLogger("kisandost")
 
 # Lazy-load Whisper model to avoid heavy import at module import in some environments
 _WHISPER_MODEL = None
@@ -24,11 +39,26 @@ _WHISPER_MODEL = None
 def _get_whisper_model():
     global _WHISPER_MODEL
     if _WHISPER_MODEL is None:
-        print(f"[ASR] Loading Whisper model: {WHISPER_MODEL}")
-        _WHISPER_MODEL = whisper.load_model(WHISPER_MODEL)
+        log.info("[ASR] Loading Whisper model: %s (%s)", WHISPER_MODEL, WHISPER_COMPUTE_TYPE)
+        _WHISPER_MODEL = WhisperModel(
+            WHISPER_MODEL,
+            device="cpu",
+            compute_type=WHISPER_COMPUTE_TYPE,
+            cpu_threads=os.cpu_count() or 0,
+        )
     return _WHISPER_MODEL
 
 
+def warmup_whisper():
+    """Load the Whisper model and transcribe 1s of silence so the first request runs hot."""
+    try:
+        model = _get_whisper_model()
+        segments, _ = model.transcribe(np.zeros(16000, dtype=np.float32), language="en")
+        list(segments)  # segments are lazy; consume to actually run the model
+    except Exception as e:
+        log.warning("[ASR] Warmup error: %s", e)
+
+
 # Translation helper
 def translate_text(text: str, source_lang: str, target_lang: str) -> str:
     """
@@ -40,17 +70,18 @@ def translate_text(text: str, source_lang: str, target_lang: str) -> str:
             return text or ""
         translator = GoogleTranslator(source=source_lang, target=target_lang)
         translated = translator.translate(text)
-        print(f"[Translate] {source_lang} -> {target_lang}: {translated[:200]}")
+        log.debug("[Translate] %s -> %s: %s", source_lang, target_lang, translated[:200])
         return translated
     except Exception as e:
-        print(f"[Translate] Error: {e}")
+        log.warning("[Translate] Error: %s", e)
         return text
 
 
 # ASR: transcribe audio -> returns plain string (or None)
-def transcribe_audio(audio_file_path: str, language: str = DEFAULT_LANGUAGE) -> str | None:
+def transcribe_audio(audio: str | Path | BinaryIO, language: str = DEFAULT_LANGUAGE) -> str | None:
     """
-    Transcribe an audio file using Whisper.
+    Transcribe audio using Whisper, from a file path or an in-memory file object
+    (e.g. io.BytesIO of an upload, which avoids a temp-file round-trip).
     Returns transcribed text (string) or None on failure.
     language should be 'en', 'ur', or 'sd' if supported by model.
     """
@@ -58,13 +89,18 @@ def transcribe_audio(audio_file_path: str, language: str = DEFAULT_LANGUAGE) ->
         model = _get_whisper_model()
         lang_map = {"en": "en", "ur": "ur", "sd": "sd"}
         lang_code = lang_map.get(language, "en")
-        print(f"[ASR] Transcribing file: {audio_file_path} (lang={lang_code})")
-        result = model.transcribe(audio_file_path, language=lang_code)
-        text = result.get("text", "").strip()
-        print(f"[ASR] Transcript (first 200 chars): {text[:200]}")
+        if isinstance(audio, Path):
+            audio = str(audio)
+        log.debug("[ASR] Transcribing: %s (lang=%s)", getattr(audio, "name", audio), lang_code)
+        # vad_filter drops silent stretches (long pauses in phone recordings)
+        segments, _ = model.transcribe(
+            audio, language=lang_code, vad_filter=True, beam_size=1
+        )
+        text = "".join(segment.text for segment in segments).strip()
+        log.debug("[ASR] Transcript (first 200 chars): %s", text[:200])
         return text
     except Exception as e:
-        print(f"[ASR] Error: {e}")
+        log.warning("[ASR] Error: %s", e)
         return None
 
 
@@ -79,16 +115,60 @@ def _clean_local_punctuation(text: str, lang: str) -> str:
     return text.strip()
 
 
+# Keep-alive session shared by all TTS calls, so concurrent/consecutive
+# syntheses reuse pooled connections instead of a fresh TLS handshake each.
+_TTS_SESSION = requests.Session()
+_TTS_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+# Audio payload in a batchexecute response line (same pattern as gTTS 2.5.4)
+_GTTS_AUDIO_RE = re.compile(r'jQ1olc","\[\\"(.*)\\"]')
+
+
+class _SessionGTTS(gTTS):
+    """
+    gTTS that sends its requests through _TTS_SESSION (stock gTTS opens a new
+    Session per text part) with TLS verification on (stock gTTS disables it).
+    Mirrors gTTS.stream() of gTTS 2.5.4, the version pinned in requirements.txt;
+    re-check it and tests/test_voice.py when upgrading gTTS.
+    """
+
+    def stream(self):
+        for pr in self._prepare_requests():
+            try:
+                r = _TTS_SESSION.send(
+                    pr, verify=True, proxies=urllib.request.getproxies(), timeout=self.timeout
+                )
+                r.raise_for_status()
+            except requests.exceptions.HTTPError:
+                raise gTTSError(tts=self, response=r)
+            except requests.exceptions.RequestException:
+                raise gTTSError(tts=self)
+
+            for line in r.iter_lines(chunk_size=1024):
+                decoded_line = line.decode("utf-8")
+                if "jQ1olc" in decoded_line:
+                    audio_search = _GTTS_AUDIO_RE.search(decoded_line)
+                    if not audio_search:
+                        raise gTTSError(tts=self, response=r)
+                    yield base64.b64decode(audio_search.group(1).encode("ascii"))
+
+
+# Already-synthesized mp3 paths keyed by (text, gTTS language)
+_TTS_CACHE = LRUCache(maxsize=128)
+_TTS_CACHE_LOCK = threading.Lock()
+
+
 # TTS: generate mp3 path (returns str path or None)
 def text_to_speech(text: str, language: str = DEFAULT_LANGUAGE, filename_prefix: str = TTS_PREFIX) -> str | None:
     """
     Convert text to speech using gTTS.
     Sindhi falls back to Urdu for TTS playback if not supported.
+    Identical text is served from the mp3 generated earlier while it still exists.
     Returns path to generated mp3 or None.
     """
     try:
         if not text or not str(text).strip():
-            print("[TTS] Empty text provided, skipping TTS.")
+            log.debug("[TTS] Empty text provided, skipping TTS.")
             return None
 
         # Determine gTTS language code; fallback for Sindhi
@@ -102,22 +182,31 @@ def text_to_speech(text: str, language: str = DEFAULT_LANGUAGE, filename_prefix:
 
         requested = language if language in ("en", "ur") else "ur"
         if available and requested not in available:
-            print(f"[TTS] Language '{language}' not supported by gTTS, falling back to 'ur'")
+            log.warning("[TTS] Language '%s' not supported by gTTS, falling back to 'ur'", language)
             requested = "ur"
 
+        cache_key = (text, requested)
+        with _TTS_CACHE_LOCK:
+            cached_path = _TTS_CACHE.get(cache_key)
+        if cached_path and os.path.exists(cached_path):
+            log.debug("[TTS] Reusing: %s", cached_path)
+            return cached_path
+
         out_dir = Path(OUTPUT_DIRS["voice_outputs"])
         out_dir.mkdir(parents=True, exist_ok=True)
-        timestamp = int(time.time())
-        filename = f"{filename_prefix}_{requested}_{timestamp}.mp3"
+        # Unique per call: concurrent requests must never share (and overwrite) a file
+        filename = f"{filename_prefix}_{requested}_{uuid.uuid4().hex}.mp3"
         out_path = out_dir / filename
 
         text = _clean_local_punctuation(text, language)
-        print(f"[TTS] Generating TTS (lang={requested}) -> {out_path}")
-        tts = gTTS(text=text, lang=requested, slow=False)
+        log.debug("[TTS] Generating TTS (lang=%s) -> %s", requested, out_path)
+        tts = _SessionGTTS(text=text, lang=requested, slow=False)
         tts.save(str(out_path))
-        print(f"[TTS] Saved: {out_path}")
+        log.debug("[TTS] Saved: %s", out_path)
+        with _TTS_CACHE_LOCK:
+            _TTS_CACHE[cache_key] = str(out_path)
         return str(out_path)
     except Exception as e:
-        print(f"[TTS] Error: {e}")
+        log.warning("[TTS] Error: %s", e)
         return None
 